@@ -6,17 +6,25 @@ Graham Greenfield, 2025
 https://github.com/grahamg/ai-git
 """
 
+import bisect
+import io
 import os
+import re
+import fnmatch
 import subprocess
 import sys
 import json
 import logging
 import pickle
+import queue
+import threading
 from requests.exceptions import RequestException, HTTPError
+from requests.adapters import HTTPAdapter
 import tempfile
 import shutil
-from dataclasses import dataclass
-from typing import List, Dict, Optional, Set
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import IO, Callable, List, Dict, Optional, Set
 from pathlib import Path
 from datetime import datetime
 import requests
@@ -24,6 +32,77 @@ import git
 from git import Repo
 import click
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Matches a "FILE: <path>" header line; each file's code block is the text
+# between the first and last fence before the next header
+_FILE_HEADER_RE = re.compile(r'^FILE:[ \t]*(.*?)[ \t]*$', re.MULTILINE)
+
+# Static parts of the prompt sent to Ollama, joined around context and request
+_PROMPT_PREFIX = """
+Based on the following context and request, provide code changes in a structured format.
+Each change should be in the format:
+FILE: <filepath>
+```
+<entire file content with changes>
+```
+
+Context files:
+"""
+_PROMPT_MIDDLE = "\n\nUser request: "
+_PROMPT_SUFFIX = "\n\nRespond only with the file changes, using the format specified above.\n"
+
+# Directories never searched for structural files
+_SKIP_DIRS = frozenset({
+    '.git', 'node_modules', '.venv', 'venv', '__pycache__', '.tox',
+    'dist', 'build', 'target', '.mypy_cache', '.pytest_cache'
+})
+
+# Lockfiles are large and rarely useful as context, so glob patterns skip them
+_LOCKFILES = frozenset({'package-lock.json', 'yarn.lock', 'pnpm-lock.yaml'})
+
+# Prompt size limits: bytes read per structural file, characters of the
+# whole context string (headers and truncation markers included)
+_MAX_FILE_BYTES = 64 * 1024
+_MAX_CONTEXT_CHARS = 256 * 1024
+_TRUNCATED_MARKER = "\n...[truncated]"
+
+# Upper bound on threads used to read context files concurrently
+_MAX_READ_WORKERS = 8
+
+def _parallel_map(func: Callable, items: List) -> List:
+    """Map an I/O-bound function over items on a small thread pool, keeping order"""
+    if len(items) < 2:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(_MAX_READ_WORKERS, len(items))) as ex:
+        return list(ex.map(func, items))
+
+def _read_text(path: Path) -> str:
+    """Read a structural file as text, truncated to _MAX_FILE_BYTES"""
+    with open(path, 'rb') as f:
+        data = f.read(_MAX_FILE_BYTES + 1)
+    if len(data) <= _MAX_FILE_BYTES:
+        return data.decode('utf-8', errors='replace')
+
+    # Back up over UTF-8 continuation bytes so no character is split
+    cut = _MAX_FILE_BYTES
+    while cut > 0 and (data[cut] & 0xC0) == 0x80:
+        cut -= 1
+    return data[:cut].decode('utf-8', errors='replace') + _TRUNCATED_MARKER
+
+def _json_dumps(obj, indent: bool = False) -> bytes:
+    """Serialize to JSON bytes, using orjson when it is installed"""
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)  # pylint: disable=no-member
+    return json.dumps(obj, indent=2 if indent else None).encode('utf-8')
+
+def _json_loads(data):
+    """Parse JSON from str or bytes, using orjson when it is installed"""
+    return orjson.loads(data) if orjson else json.loads(data)  # pylint: disable=no-member
+
 @dataclass
 class Session:
     """Represents a modification session"""
@@ -31,6 +110,30 @@ class Session:
     context_files: Set[str]
     changes_history: List[Dict]
     created_at: str
+    # Sorted view of context_files, kept in step by the methods below
+    context_files_sorted: List[str] = field(default_factory=list, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.context_files_sorted = sorted(self.context_files)
+
+    def add_context_file(self, file_path: str):
+        """Add a file to the context, keeping the sorted view in step"""
+        if file_path not in self.context_files:
+            self.context_files.add(file_path)
+            bisect.insort(self.context_files_sorted, file_path)
+
+    def remove_context_file(self, file_path: str):
+        """Remove a file from the context; raises KeyError if it is absent"""
+        index = bisect.bisect_left(self.context_files_sorted, file_path)
+        if index == len(self.context_files_sorted) or self.context_files_sorted[index] != file_path:
+            raise KeyError(file_path)
+        self.context_files.remove(file_path)
+        del self.context_files_sorted[index]
+
+    def clear_context_files(self):
+        """Remove all files from the context"""
+        self.context_files.clear()
+        self.context_files_sorted.clear()
 
     def to_dict(self) -> Dict:
         return {
@@ -49,32 +152,49 @@ class Session:
             created_at=data['created_at']
         )
 
+@dataclass
+class GitStatus:
+    """Working tree state parsed from a single git status call"""
+    modified: List[str]
+    deleted: List[str]
+    untracked: List[str]
+    staged: List[str]
+
+    def is_dirty(self, untracked: bool = False) -> bool:
+        return bool(self.modified or self.deleted or self.staged
+                    or (untracked and self.untracked))
+
 class GitToolConfig:
     """Configuration management for the tool"""
     def __init__(self, repo_path: Path):
         self.repo_path = repo_path
         self.config_path = repo_path / '.git' / 'ai-tool-config.json'
-        self.structural_patterns = self._load_config().get('structural_patterns', [
-            "package.json",
-            "requirements.txt",
-            "go.mod",
-            "Cargo.toml",
-            "setup.py"
-        ])
+        self._structural_patterns: Optional[List[str]] = None
+
+    @property
+    def structural_patterns(self) -> List[str]:
+        """Structural file patterns, loaded from the config file on first access"""
+        if self._structural_patterns is None:
+            self._structural_patterns = self._load_config().get('structural_patterns', [
+                "package.json",
+                "requirements.txt",
+                "go.mod",
+                "Cargo.toml",
+                "setup.py"
+            ])
+        return self._structural_patterns
 
     def _load_config(self) -> Dict:
         if self.config_path.exists():
-            with open(self.config_path) as f:
-                return json.load(f)
+            return _json_loads(self.config_path.read_bytes())
         return {}
 
     def save_config(self):
         config = {'structural_patterns': self.structural_patterns}
-        with open(self.config_path, 'w') as f:
-            json.dump(config, f, indent=2)
+        self.config_path.write_bytes(_json_dumps(config, indent=True))
 
     def update_structural_patterns(self, patterns: List[str]):
-        self.structural_patterns = patterns
+        self._structural_patterns = patterns
         self.save_config()
 
 class AIGitTool:
@@ -84,9 +204,24 @@ class AIGitTool:
         self.repo = Repo(self.repo_path)
         self.docs_dir = self.repo_path / "ai-tool-docs"
         self.docs_dir.mkdir(exist_ok=True)
-        self.session_file = self.repo_path / '.git' / 'ai-tool-session.pickle'
+        self.session_file = self.repo_path / '.git' / 'ai-tool-session.json'
+        self.legacy_session_file = self.repo_path / '.git' / 'ai-tool-session.pickle'
+        self.structural_cache_file = self.repo_path / '.git' / 'ai-tool-structural-cache.json'
         self.config = GitToolConfig(self.repo_path)
 
+        # In-memory caches of file contents, invalidated by mtime changes
+        self._structural_cache: Optional[Dict[str, str]] = None
+        self._structural_cache_sig: Optional[tuple] = None
+        self._context_cache: Dict[str, tuple] = {}
+
+        # Reuse one keep-alive connection pool for all Ollama API calls
+        self.http = requests.Session()
+        self.http.headers.update({
+            'Connection': 'keep-alive',
+            'Accept-Encoding': 'gzip, deflate'
+        })
+        self.http.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=0))
+
         # Configure logging
         logging.basicConfig(
             level=logging.INFO,
@@ -94,28 +229,124 @@ class AIGitTool:
         )
         self.logger = logging.getLogger("ai-git-tool")
 
+        # Session, cache and documentation writes happen on a background
+        # thread so they never block the next REPL command
+        self._write_queue: queue.Queue = queue.Queue()
+        self._writer = threading.Thread(target=self._writer_loop, daemon=True)
+        self._writer.start()
+
+        # Structural file contents persisted across runs, keyed on (mtime_ns, size);
+        # loaded on first use by the persistent_cache property
+        self._persistent_cache: Optional[Dict[str, Dict]] = None
+        self._persistent_cache_dirty = False
+
+        # Append handle for the current branch's documentation file, opened
+        # by _init_documentation or on the first update_documentation call
+        self._doc_path: Optional[Path] = None
+        self._doc_fp: Optional[IO] = None
+
         self.session = self._load_session()
+        self._session_dirty = False
+
+    def _writer_loop(self):
+        """Run queued write operations until the stop sentinel is received"""
+        while True:
+            item = self._write_queue.get()
+            try:
+                if item is None:
+                    return
+                func, args = item
+                func(*args)
+            except Exception as e:
+                self.logger.error(f"Background write failed: {e}")
+            finally:
+                self._write_queue.task_done()
+
+    def _enqueue_write(self, func: Callable, *args):
+        """Queue a write operation, running it inline once the writer has stopped"""
+        if self._writer.is_alive():
+            self._write_queue.put((func, args))
+        else:
+            func(*args)
+
+    def _drain_writes(self):
+        """Block until all queued writes have completed"""
+        if self._writer.is_alive():
+            self._write_queue.join()
+
+    def stop_writer(self):
+        """Drain pending writes and stop the background writer thread"""
+        if self._writer.is_alive():
+            self._write_queue.put(None)
+            self._writer.join()
+
+    @property
+    def persistent_cache(self) -> Dict[str, Dict]:
+        """Persisted structural file cache, loaded from disk on first access"""
+        if self._persistent_cache is None:
+            self._persistent_cache = self._load_structural_cache()
+        return self._persistent_cache
+
+    def _load_structural_cache(self) -> Dict[str, Dict]:
+        """Load the persisted structural file cache if available"""
+        if self.structural_cache_file.exists():
+            try:
+                return _json_loads(self.structural_cache_file.read_bytes())
+            except Exception as e:
+                self.logger.error(f"Failed to load structural file cache: {e}")
+        return {}
+
+    def _save_structural_cache(self):
+        """Persist the structural file cache if it changed"""
+        if self._persistent_cache_dirty:
+            data = _json_dumps(self._persistent_cache)
+            self._enqueue_write(self.structural_cache_file.write_bytes, data)
+            self._persistent_cache_dirty = False
 
     def _load_session(self) -> Optional[Session]:
         """Load existing session if available"""
         if self.session_file.exists():
             try:
-                with open(self.session_file, 'rb') as f:
-                    return pickle.load(f)
+                return Session.from_dict(_json_loads(self.session_file.read_bytes()))
             except Exception as e:
                 self.logger.error(f"Failed to load session: {e}")
+        elif self.legacy_session_file.exists():
+            return self._migrate_legacy_session()
         return None
 
+    def _migrate_legacy_session(self) -> Optional[Session]:
+        """Convert a session saved by older versions from pickle to JSON"""
+        try:
+            with open(self.legacy_session_file, 'rb') as f:
+                # Rebuild through from_dict so derived fields are initialized
+                session = Session.from_dict(pickle.load(f).to_dict())
+            self.session_file.write_bytes(_json_dumps(session.to_dict(), indent=True))
+            self.legacy_session_file.unlink()
+            return session
+        except Exception as e:
+            self.logger.error(f"Failed to migrate legacy session: {e}")
+            return None
+
     def _save_session(self):
-        """Save current session"""
-        if self.session:
-            with open(self.session_file, 'wb') as f:
-                pickle.dump(self.session, f)
+        """Mark current session as changed; it is written by _flush_session"""
+        self._session_dirty = True
+
+    def _flush_session(self):
+        """Write current session to disk if it changed since the last flush"""
+        if self._session_dirty and self.session:
+            data = _json_dumps(self.session.to_dict(), indent=True)
+            self._enqueue_write(self.session_file.write_bytes, data)
+        self._session_dirty = False
+        self._save_structural_cache()
 
     def clear_session(self):
         """Clear the current session and cleanup temporary files"""
-        if self.session_file.exists():
-            self.session_file.unlink()
+        self._session_dirty = False
+        self._save_structural_cache()
+        self._drain_writes()
+        for path in (self.session_file, self.legacy_session_file):
+            if path.exists():
+                path.unlink()
 
         # Cleanup any temporary files
         temp_dir = Path(tempfile.gettempdir()) / "aigit"
@@ -123,6 +354,8 @@ class AIGitTool:
             shutil.rmtree(temp_dir, ignore_errors=True)
 
         self.session = None
+        self._close_documentation()
+        self.http.close()
 
     def create_branch(self, branch_name: str) -> bool:
         """Create and switch to a new branch"""
@@ -143,6 +376,7 @@ class AIGitTool:
                 created_at=str(datetime.now())
             )
             self._save_session()
+            self._flush_session()
             self._init_documentation(branch_name)
             return True
 
@@ -150,14 +384,29 @@ class AIGitTool:
             self.logger.error(f"Failed to create branch: {e}")
             return False
 
+    def _open_documentation(self, branch_name: str, mode: str):
+        """Open a line-buffered handle on the branch documentation file"""
+        self._close_documentation()
+        self._doc_path = self.docs_dir / f"{branch_name}.md"
+        # Kept open across prompts and closed by _close_documentation
+        self._doc_fp = open(self._doc_path, mode, buffering=1)  # pylint: disable=consider-using-with
+
+    def _close_documentation(self):
+        """Close the documentation handle if one is open"""
+        self._drain_writes()
+        if self._doc_fp:
+            self._doc_fp.close()
+        self._doc_fp = None
+        self._doc_path = None
+
     def _init_documentation(self, branch_name: str):
         """Initialize documentation for new branch"""
-        doc_path = self.docs_dir / f"{branch_name}.md"
-        with open(doc_path, 'w') as f:
-            f.write(f"# AI-Assisted Changes: {branch_name}\n\n")
-            f.write("## Change History\n\n")
-            f.write("| Timestamp | Prompt | Changes | Commit |\n")
-            f.write("|-----------|---------|----------|--------|\n")
+        self._open_documentation(branch_name, 'w')
+        f = self._doc_fp
+        f.write(f"# AI-Assisted Changes: {branch_name}\n\n")
+        f.write("## Change History\n\n")
+        f.write("| Timestamp | Prompt | Changes | Commit |\n")
+        f.write("|-----------|---------|----------|--------|\n")
 
     def update_documentation(self, prompt: str, changes: Dict[str, str], commit_hash: str):
         """Update documentation with new changes"""
@@ -166,7 +415,8 @@ class AIGitTool:
             return
 
         try:
-            doc_path = self.docs_dir / f"{self.session.branch}.md"
+            if not self._doc_fp:
+                self._open_documentation(self.session.branch, 'a')
             timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
             # Create a more detailed change summary
@@ -177,8 +427,8 @@ class AIGitTool:
 
             changes_text = "\n".join(changes_summary)
 
-            with open(doc_path, 'a') as f:
-                f.write(f"| {timestamp} | {prompt} | {changes_text} | {commit_hash} |\n")
+            row = f"| {timestamp} | {prompt} | {changes_text} | {commit_hash} |\n"
+            self._enqueue_write(self._doc_fp.write, row)
 
             # Update session history
             self.session.changes_history.append({
@@ -195,16 +445,100 @@ class AIGitTool:
 
     def get_structural_files(self) -> Dict[str, str]:
         """Get content of structural project files"""
+        stats = [(path, path.stat()) for path in self._find_structural_paths()]
+
+        # Only re-read when the set of matches or any of their mtimes changed
+        sig = tuple((str(path), st.st_mtime_ns, st.st_size) for path, st in stats)
+        if sig == self._structural_cache_sig:
+            return self._structural_cache
+
         files_content = {}
-        for pattern in self.config.structural_patterns:
-            for path in self.repo_path.rglob(pattern):
-                if path.is_file():
-                    with open(path) as f:
-                        files_content[str(path.relative_to(self.repo_path))] = f.read()
+        to_read = []
+        for path, st in stats:
+            rel_path = str(path.relative_to(self.repo_path))
+            key = [st.st_mtime_ns, st.st_size]
+            cached = self.persistent_cache.get(rel_path)
+            if cached and cached['key'] == key:
+                files_content[rel_path] = cached['content']
+            else:
+                # Placeholder keeps the discovery order of the result
+                files_content[rel_path] = None
+                to_read.append((rel_path, path, key))
+
+        contents = _parallel_map(_read_text, [path for _, path, _ in to_read])
+        for (rel_path, _, key), content in zip(to_read, contents):
+            self.persistent_cache[rel_path] = {'key': key, 'content': content}
+            self._persistent_cache_dirty = True
+            files_content[rel_path] = content
+
+        # Drop entries for files that no longer match
+        for rel_path in set(self.persistent_cache) - set(files_content):
+            del self.persistent_cache[rel_path]
+            self._persistent_cache_dirty = True
+
+        self._structural_cache = files_content
+        self._structural_cache_sig = sig
         return files_content
 
-    def make_ollama_request(self, prompt: str) -> dict:
-        """Make request to Ollama API with current context"""
+    def _find_structural_paths(self) -> List[Path]:
+        """Find files matching the structural patterns in a single walk"""
+        patterns = self.config.structural_patterns
+        names = {p for p in patterns if not any(c in p for c in '*?[')}
+        globs = [fnmatch.translate(p) for p in patterns if p not in names]
+        glob_re = re.compile('|'.join(globs)) if globs else None
+
+        paths = []
+
+        def walk(directory: str):
+            # Skip unreadable directories, as rglob does
+            try:
+                entries = os.scandir(directory)
+            except OSError:
+                return
+            with entries:
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in _SKIP_DIRS:
+                            walk(entry.path)
+                    elif not entry.is_file(follow_symlinks=False):
+                        continue
+                    elif entry.name in names:
+                        paths.append(Path(entry.path))
+                    elif glob_re and glob_re.match(entry.name) and not (
+                            entry.name in _LOCKFILES or entry.name.endswith('.lock')):
+                        paths.append(Path(entry.path))
+
+        walk(str(self.repo_path))
+        return sorted(paths)
+
+    def _read_context_file(self, full_path: Path) -> str:
+        """Read a context file, reusing the cached content if it is unchanged"""
+        st = full_path.stat()
+        key = (st.st_mtime_ns, st.st_size)
+        cached = self._context_cache.get(str(full_path))
+        if cached and cached[0] == key:
+            return cached[1]
+
+        content = full_path.read_bytes().decode('utf-8', errors='replace')
+        self._context_cache[str(full_path)] = (key, content)
+        return content
+
+    def _evict_context_cache(self, file_path: Optional[str] = None):
+        """Drop the cached content of one context file, or of all of them"""
+        if file_path is None:
+            self._context_cache.clear()
+        else:
+            self._context_cache.pop(str(self.repo_path / file_path), None)
+
+    def make_ollama_request(self, prompt: str,
+                            on_token: Optional[Callable[[str], None]] = None) -> dict:
+        """Make streaming request to Ollama API with current context
+
+        Each generated chunk is passed to on_token as it arrives; the
+        returned dict has the same shape as a non-streaming response.
+        """
         if not self.session:
             raise ValueError("No active session")
 
@@ -213,54 +547,100 @@ class AIGitTool:
         except Exception as e:
             raise ValueError(f"Failed to build context: {str(e)}")
 
-        structured_prompt = f"""
-Based on the following context and request, provide code changes in a structured format.
-Each change should be in the format:
-FILE: <filepath>
-```
-<entire file content with changes>
-```
+        # Persist pending session edits before the long-running request
+        self._flush_session()
 
-Context files:
-{context}
-
-User request: {prompt}
-
-Respond only with the file changes, using the format specified above.
-"""
+        structured_prompt = ''.join((
+            _PROMPT_PREFIX, context, _PROMPT_MIDDLE, prompt, _PROMPT_SUFFIX
+        ))
 
         payload = {
             "model": "llama3",
             "prompt": structured_prompt,
-            "stream": False,
+            "stream": True,
             "temperature": 0.7
         }
 
         try:
-            response = requests.post(f"{self.ollama_host}/api/generate", json=payload)
-            response.raise_for_status()
-            return response.json()
+            response = self.http.post(
+                f"{self.ollama_host}/api/generate",
+                data=_json_dumps(payload),
+                headers={'Content-Type': 'application/json'},
+                timeout=(5, 300),
+                stream=True
+            )
+            parts = []
+            final = {}
+            with response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = _json_loads(line)
+                    if 'error' in chunk:
+                        raise RequestException(f"Ollama error: {chunk['error']}")
+                    token = chunk.get('response', '')
+                    parts.append(token)
+                    if on_token and token:
+                        on_token(token)
+                    if chunk.get('done'):
+                        final = chunk
+            return {**final, 'response': ''.join(parts)}
         except Exception as e:
             self.logger.error(f"Ollama API request failed: {e}")
             raise
 
     def _build_context(self) -> str:
         """Build context string from current session files"""
-        context_parts = []
-
-        # Add structural files
         structural_files = self.get_structural_files()
-        for file_path, content in structural_files.items():
-            context_parts.append(f"File: {file_path}\n{content}\n")
+        context_paths = [
+            file_path for file_path in self.session.context_files_sorted
+            if (self.repo_path / file_path).exists()
+        ]
+        contents = _parallel_map(
+            lambda file_path: self._read_context_file(self.repo_path / file_path),
+            context_paths
+        )
+
+        buf = io.StringIO()
+        remaining = _MAX_CONTEXT_CHARS
+        omitted = []
+
+        def write(file_path: str, content: str):
+            buf.write("File: ")
+            buf.write(file_path)
+            buf.write("\n")
+            buf.write(content)
+            buf.write("\n\n")
 
-        # Add session context files
-        for file_path in self.session.context_files:
-            full_path = self.repo_path / file_path
-            if full_path.exists():
-                with open(full_path) as f:
-                    context_parts.append(f"File: {file_path}\n{f.read()}\n")
+        def overhead(file_path: str) -> int:
+            # Characters write() adds around the file content
+            return len("File: \n\n\n") + len(file_path)
+
+        # Structural files take priority and may be trimmed to fit
+        for file_path, content in structural_files.items():
+            room = remaining - overhead(file_path)
+            if len(content) > room:
+                room -= len(_TRUNCATED_MARKER)
+                if room <= 0:
+                    omitted.append(file_path)
+                    continue
+                content = content[:room] + _TRUNCATED_MARKER
+            remaining -= overhead(file_path) + len(content)
+            write(file_path, content)
+
+        # Session context files are never cut, since the model returns them
+        # in full and apply_changes would write a truncated copy back
+        for file_path, content in zip(context_paths, contents):
+            if overhead(file_path) + len(content) > remaining:
+                omitted.append(file_path)
+                continue
+            remaining -= overhead(file_path) + len(content)
+            write(file_path, content)
 
-        return "\n".join(context_parts)
+        if omitted:
+            self.logger.warning(f"Context size limit reached, omitting: {', '.join(omitted)}")
+        return buf.getvalue()
 
     def apply_changes(self, changes: Dict[str, str]) -> bool:
         """Apply proposed changes to files"""
@@ -275,11 +655,56 @@ Respond only with the file changes, using the format specified above.
             self.logger.error(f"Failed to apply changes: {e}")
             return False
 
-    def commit_changes(self, message: str) -> Optional[str]:
+    def _git_status(self) -> GitStatus:
+        """Get modified, deleted, untracked and staged paths in one git call"""
+        result = subprocess.run(
+            ['git', '-C', str(self.repo_path), 'status', '--porcelain=v2', '-z',
+             '--untracked-files=all'],
+            capture_output=True, text=True, check=True
+        )
+        status = GitStatus(modified=[], deleted=[], untracked=[], staged=[])
+        # Number of spaces before the path for each changed-entry type
+        path_field = {'1': 8, '2': 9, 'u': 10}
+
+        entries = iter(result.stdout.split('\0'))
+        for entry in entries:
+            if not entry:
+                continue
+            kind = entry[0]
+            if kind == '?':
+                status.untracked.append(entry[2:])
+            elif kind in path_field:
+                fields = entry.split(' ', path_field[kind])
+                xy, path = fields[1], fields[-1]
+                if kind == '2':
+                    next(entries, None)  # rename source path
+                if xy[0] != '.':
+                    status.staged.append(path)
+                if xy[1] == 'D':
+                    status.deleted.append(path)
+                elif xy[1] != '.':
+                    status.modified.append(path)
+        return status
+
+    def commit_changes(self, message: str, status: Optional[GitStatus] = None) -> Optional[str]:
         """Commit current changes"""
         try:
-            self.repo.index.add('*')
+            if status is None:
+                status = self._git_status()
+
+            if not status.is_dirty(untracked=True):
+                self.logger.warning("No changes to commit")
+                return None
+
+            # Stage only modified, deleted and untracked files instead of
+            # re-hashing the whole worktree
+            to_add = status.modified + status.untracked
+            if to_add:
+                self.repo.index.add(to_add)
+            if status.deleted:
+                self.repo.index.remove(status.deleted)
             commit = self.repo.index.commit(message)
+            self._flush_session()
             return commit.hexsha
         except Exception as e:
             self.logger.error(f"Failed to commit changes: {e}")
@@ -307,7 +732,7 @@ Respond only with the file changes, using the format specified above.
             main = self.repo.heads.main
 
             # Check for uncommitted changes
-            if self.repo.is_dirty():
+            if self._git_status().is_dirty():
                 self.logger.error("Working directory is not clean. Commit or stash changes first.")
                 return False
 
@@ -393,6 +818,9 @@ class AIGitREPL:
             except Exception as e:
                 print(f"Error: {e}")
 
+        self.tool._flush_session()
+        self.tool.stop_writer()
+
     def show_help(self):
         """Show available commands"""
         print("""
@@ -432,12 +860,10 @@ Commands:
             return
 
         try:
-            response = self.tool.make_ollama_request(args)
-            parts = response['response'].split('FILE:', 1)
-            if len(parts) > 1:
-                explanation = parts[0].strip()
-                if explanation:
-                    print(f"\n{explanation}\n")
+            print()
+            response = self.tool.make_ollama_request(
+                args, on_token=lambda token: print(token, end='', flush=True))
+            print("\n")
 
             changes = self._parse_ollama_response(response)
             if self.tool.apply_changes(changes):
@@ -451,26 +877,24 @@ Commands:
             raise ValueError("Invalid response from Ollama")
 
         content = response['response']
+        headers = list(_FILE_HEADER_RE.finditer(content))
         changes = {}
 
-        # Split into file sections
-        sections = content.split('FILE: ')
-        for section in sections[1:]:
-            try:
-                lines = section.split('\n', 1)
-                filename = lines[0].strip()
+        for i, header in enumerate(headers):
+            filename = header.group(1)
+            end = headers[i + 1].start() if i + 1 < len(headers) else len(content)
+            section = content[header.end():end]
 
-                # Extract code block
-                content_start = section.find('```') + 3
-                content_end = section.rfind('```')
-
-                if content_start > 2 and content_end > content_start:
-                    file_content = section[content_start:content_end].strip()
-                    changes[filename] = file_content
-
-            except Exception as e:
-                print(f"Warning: Failed to parse section: {e}")
+            # Body starts after the opening fence line (dropping any language
+            # tag) and ends at the last fence, so nested fences are kept
+            content_start = section.find('```')
+            if content_start == -1:
                 continue
+            content_start = section.find('\n', content_start) + 1
+            content_end = section.rfind('```')
+
+            if filename and 0 < content_start <= content_end:
+                changes[filename] = section[content_start:content_end].strip()
 
         if not changes:
             raise ValueError("No valid changes found in response")
@@ -506,12 +930,13 @@ Commands:
             return
 
         # Check if there are any changes to commit
-        if not any(self.tool.repo.index.diff(None)) and not self.tool.repo.untracked_files:
+        status = self.tool._git_status()
+        if not status.is_dirty(untracked=True):
             print("No changes to commit")
             return
 
         try:
-            commit_hash = self.tool.commit_changes(args)
+            commit_hash = self.tool.commit_changes(args, status)
             if commit_hash:
                 print(f"Changes committed: {commit_hash}")
                 print("Use 'review' to verify the commit or 'rollback' to undo")
@@ -562,7 +987,7 @@ Commands:
             print(f"File not found: {args}")
             return
 
-        self.tool.session.context_files.add(str(file_path))
+        self.tool.session.add_context_file(str(file_path))
         self.tool._save_session()
         print(f"Added to context: {args}")
 
@@ -577,7 +1002,8 @@ Commands:
             return
 
         if args in self.tool.session.context_files:
-            self.tool.session.context_files.remove(args)
+            self.tool.session.remove_context_file(args)
+            self.tool._evict_context_cache(args)
             self.tool._save_session()
             print(f"Removed from context: {args}")
         else:
@@ -590,7 +1016,8 @@ Commands:
             print("No active session")
             return
 
-        self.tool.session.context_files.clear()
+        self.tool.session.clear_context_files()
+        self.tool._evict_context_cache()
         self.tool._save_session()
         print("Context cleared")
 
@@ -605,8 +1032,8 @@ Commands:
             print(f"  - {pattern}")
 
         print("\nContext files:")
-        if self.tool.session.context_files:
-            for file in sorted(self.tool.session.context_files):
+        if self.tool.session.context_files_sorted:
+            for file in self.tool.session.context_files_sorted:
                 print(f"  - {file}")
         else:
             print("  (none)")
@@ -0,0 +1,69 @@
+"""
+Tests for parsing Ollama responses into file changes.
+"""
+
+import time
+
+import pytest
+
+from aigit import AIGitREPL
+
+
+def parse(text):
+    """Parse a raw model response without needing a repository"""
+    repl = AIGitREPL.__new__(AIGitREPL)
+    return repl._parse_ollama_response({'response': text})  # pylint: disable=protected-access
+
+
+def test_strips_language_tag():
+    """The language tag on the opening fence is not part of the file"""
+    assert parse("FILE: a.py\n```python\nx = 1\n```\n") == {'a.py': 'x = 1'}
+
+
+def test_keeps_nested_fences():
+    """Fences inside the file body do not end the block"""
+    text = "FILE: README.md\n```markdown\n# T\n\n```bash\nls\n```\n\nmore\n```"
+    assert parse(text) == {'README.md': '# T\n\n```bash\nls\n```\n\nmore'}
+
+
+def test_blank_line_before_fence():
+    """Blank lines between the header and the fence are allowed"""
+    assert parse("FILE: a.py\n\n```python\nx = 1\n```\n") == {'a.py': 'x = 1'}
+
+
+def test_prose_after_last_block():
+    """Explanation after the last block does not hide the file"""
+    text = "FILE: a.py\n```python\nprint(1)\n```\n\nThis adds a print.\n"
+    assert parse(text) == {'a.py': 'print(1)'}
+
+
+def test_prose_between_blocks():
+    """Explanation between blocks does not merge the files"""
+    text = "FILE: a.py\n```\nx=1\n```\nExplanation.\n\nFILE: b.py\n```\ny=2\n```"
+    assert parse(text) == {'a.py': 'x=1', 'b.py': 'y=2'}
+
+
+def test_header_without_fence_is_skipped():
+    """A header without a code block does not take the next file"""
+    text = "FILE: a.py\n(unchanged)\nFILE: b.py\n```\ny=2\n```"
+    assert parse(text) == {'b.py': 'y=2'}
+
+
+def test_empty_block():
+    """An empty code block yields an empty file"""
+    assert parse("FILE: e.txt\n```\n```\n") == {'e.txt': ''}
+
+
+def test_unclosed_fences_parse_quickly():
+    """Truncated output with unclosed fences parses in linear time"""
+    text = "".join(f"FILE: f{i}.py\n```python\n{'x = 1' * 50}\n" for i in range(200))
+    start = time.monotonic()
+    with pytest.raises(ValueError):
+        parse(text)
+    assert time.monotonic() - start < 1
+
+
+def test_no_changes_raises():
+    """A response without any file blocks is rejected"""
+    with pytest.raises(ValueError):
+        parse("Sorry, I can't help with that.")